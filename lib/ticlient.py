@@ -27,6 +27,8 @@ THE SOFTWARE.
 
 
 import binascii
+import collections
+import errno
 import hashlib
 import httplib
 import json
@@ -34,28 +36,338 @@ import logging
 import os
 import socket
 import operator
+import shutil
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+def create_file(directory, prefix, suffix=''):
+    """
+    creates a new file under a random name for writing, its mode set by the
+    umask as open() would, where mkstemp would make it private to its owner
+    returns (handle, path)
+    """
+    while True:
+        path = os.path.join(directory, prefix + binascii.hexlify(os.urandom(8)) + suffix)
+        try:
+            return os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666), path
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
 
 
 class TiError(Exception):
     pass
 
 
+class ConnectionPool(object):
+    """
+    Idle HTTP/1.1 connections to a single team interface, kept for reuse
+    """
+
+    def __init__(self, host, port, max_idle=4):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+
+    def connect(self):
+        return httplib.HTTPConnection(self.host, self.port)
+
+    def get(self):
+        """
+        returns (connection, reused) preferring an idle connection
+        """
+        with self.lock:
+            if len(self.idle):
+                self.hits += 1
+                return self.idle.pop(), True
+            self.misses += 1
+        return self.connect(), False
+
+    def put(self, conn):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            hit_rate = 0.0
+            if total:
+                hit_rate = float(self.hits) / total
+            return {'hits': self.hits, 'misses': self.misses,
+                    'reconnects': self.reconnects, 'idle': len(self.idle),
+                    'hit_rate': hit_rate}
+
+
+class MultipartBody(object):
+    """
+    multipart/form-data request body streamed from disk in blocks.  The
+    length is known before sending and the SHA-256 of each file is computed
+    while it is sent, so no file is ever held in memory in full.
+    """
+
+    block_size = 65536
+
+    def __init__(self, boundary, fields, files):
+        """
+        boundary -- the multipart boundary
+        fields -- sequence of (name,value) to encode into the form
+        files -- sequence of (name,filename,path) where path is on the local filesystem
+        """
+        self.parts = []
+        for (name, value) in fields:
+            self.parts.append('--%s\r\nContent-Disposition: form-data; '
+                              'name="%s"\r\n\r\n%s\r\n' % (boundary, name, value))
+        for (name, filename, path) in files:
+            self.parts.append('--%s\r\nContent-Disposition: form-data; '
+                              'name="%s"; filename="%s"\r\nContent-Type: '
+                              'application/octet-stream\r\n\r\n' % (boundary, name, filename))
+            self.parts.append((name, path, os.path.getsize(path)))
+            self.parts.append('\r\n')
+        self.parts.append('--%s--\r\n' % boundary)
+
+        self.length = 0
+        for part in self.parts:
+            if isinstance(part, tuple):
+                self.length += part[2]
+            else:
+                self.length += len(part)
+
+        self.hashes = {}
+        self.current = None
+        self.rewind()
+
+    def __len__(self):
+        return self.length
+
+    def rewind(self):
+        """ restart from the beginning, e.g. to resend the request """
+        self._close_current()
+        self.index = 0
+        self.hashes = {}
+
+    def _close_current(self):
+        if self.current is not None:
+            self.current[0].close()
+            self.current = None
+
+    def read(self, size=-1):
+        """
+        returns up to size bytes of the body, or '' once it is exhausted
+        """
+        if size < 0:
+            size = self.block_size
+
+        while self.index < len(self.parts):
+            part = self.parts[self.index]
+
+            if not isinstance(part, tuple):
+                self.index += 1
+                return part
+
+            name, path, length = part
+            if self.current is None:
+                try:
+                    infile = open(path, 'rb')
+                except IOError:
+                    raise TiError('unable to open file: %s' % path)
+                self.current = [infile, hashlib.sha256(), length]
+
+            infile, sha256, remaining = self.current
+            block = infile.read(min(size, remaining))
+            if remaining and not block:
+                raise TiError('file changed during upload: %s' % path)
+
+            sha256.update(block)
+            self.current[2] -= len(block)
+            if self.current[2] == 0:
+                self.hashes[name] = sha256.hexdigest()
+                self._close_current()
+                self.index += 1
+
+            if block:
+                return block
+
+        return ''
+
+
+class BlobCache(object):
+    """
+    Content-addressed store of downloaded files named by their SHA-256.
+    Once the total size passes max_bytes the least recently used files are
+    evicted.  Recency is kept in file mtimes so it survives restarts.
+    """
+
+    def __init__(self, directory, max_bytes):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        found = []
+        for name in os.listdir(directory):
+            if len(name) != 64 or name.startswith('.'):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            found.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.size += size
+
+    def path(self, checksum):
+        return os.path.join(self.directory, checksum)
+
+    def get(self, checksum):
+        """
+        returns the path of the cached file, or None
+        """
+        with self.lock:
+            if checksum not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries[checksum] = self.entries.pop(checksum)
+
+        path = self.path(checksum)
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def discard(self, checksum):
+        """
+        forgets a cached file found to be missing, such as one removed by
+        something other than this cache
+        """
+        with self.lock:
+            if checksum in self.entries and not os.path.exists(self.path(checksum)):
+                self.size -= self.entries.pop(checksum)
+
+    def add(self, checksum):
+        """
+        records a file written to path(checksum), evicting older entries as
+        needed.  Cached files are made read-only, as hardlinks share them.
+        returns the path of the cached file
+        """
+        path = self.path(checksum)
+        os.chmod(path, 0o444)
+        size = os.path.getsize(path)
+
+        evict = []
+        with self.lock:
+            if checksum in self.entries:
+                self.size -= self.entries.pop(checksum)
+            self.entries[checksum] = size
+            self.size += size
+
+            for name in self.entries.keys():
+                if self.size <= self.max_bytes or name == checksum:
+                    break
+                self.size -= self.entries.pop(name)
+                self.evictions += 1
+                evict.append(name)
+
+        for name in evict:
+            logging.debug("evicting %s from download cache", name)
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+
+        return path
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self.entries),
+                    'bytes': self.size}
+
+
 class TiClient(object):
     """
     Very basic example client demonstrating the CGC Team Interface
     """
 
     good_http = [200, 301]
+    block_size = 65536
 
-    def __init__(self, ti_server, ti_port, user, password):
+    def __init__(self, ti_server, ti_port, user, password, max_idle=4,
+                 status_ttl=1.0, cache_dir=None, cache_max_bytes=1024**3,
+                 dl_workers=4, max_documents=256):
+        """
+        max_idle -- number of idle connections kept for reuse
+        status_ttl -- seconds a fetched /status may be reused, 0 disables
+        cache_dir -- directory for the consensus download cache, None disables
+        cache_max_bytes -- size cap of the consensus download cache
+        dl_workers -- number of consensus files downloaded in parallel
+        max_documents -- number of fetched documents kept, with their ETags,
+                         to revalidate with conditional requests
+        """
         self.ti_server = ti_server
         self.ti_port = ti_port
         self.user = user
         self.password = password
-
-    def getTeams(self):
+        self.pool = ConnectionPool(ti_server, ti_port, max_idle)
+        self.auth_lock = threading.Lock()
+        self.challenge = None
+        self.nonce_count = 0
+        self.ha1 = None
+        self.status_ttl = status_ttl
+        self.status_cache = None
+        self.dl_workers = dl_workers
+        self.dl_pool = None
+        self.dl_lock = threading.Lock()
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = BlobCache(cache_dir, cache_max_bytes)
+        self.max_documents = max_documents
+        self.documents = collections.OrderedDict()
+        self.documents_lock = threading.Lock()
+
+    def close(self):
+        """ close any idle connections to the server """
+        if self.dl_pool is not None:
+            self.dl_pool.close()
+            self.dl_pool.join()
+            self.dl_pool = None
+        self.pool.close()
+
+    def cache_stats(self):
+        """ get dict of consensus download cache counters """
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    def pool_stats(self):
+        """ get dict of connection pool counters, including hit_rate """
+        return self.pool.stats()
+
+    def getTeams(self, cached=True):
         """ get list of teams"""
-        status = self.getStatus()
+        status = self.getStatus(cached)
 
         ret = []
         for team_t in status['scores']:
@@ -64,50 +376,55 @@ class TiClient(object):
         ret.sort()
         return ret
 
-    def getRound(self):
+    def getRound(self, cached=True):
         """ get the current round """
 
-        status = self.getStatus()
+        status = self.getStatus(cached)
         return status['round']
 
-    def getCounts(self):
+    def getCounts(self, cached=True):
         """ get dict of counts """
         ret = {}
 
-        status = self.getStatus()
+        status = self.getStatus(cached)
 
         ret['team'] = len(status['scores'])
         ret['round'] = status['round']
 
-        pov_feedback = self.getFeedback('pov', status['round'])
+        pov_feedback = self.getFeedback('pov', status['round'], cached)
         ret['pov'] = len(pov_feedback)
 
-        poll_feedback = self.getFeedback('poll', status['round'])
+        poll_feedback = self.getFeedback('poll', status['round'], cached)
         ret['poll'] = len(poll_feedback)
 
-        cb_feedback = self.getFeedback('cb', status['round'])
+        cb_feedback = self.getFeedback('cb', status['round'], cached)
         ret['cb'] = len(cb_feedback)
 
         return ret
 
-    def validate_round(self, round_id):
+    def validate_round(self, round_id, cached=True):
         try:
             round_id = int(round_id)
         except ValueError:
             raise TiError('invalid round')
 
-        if round_id < 0 or round_id > self.getRound():
+        if round_id < 0:
             raise TiError('invalid round')
 
+        if round_id > self.getRound(cached):
+            # the round may have advanced since the status was cached
+            if not cached or round_id > self.getRound(False):
+                raise TiError('invalid round')
+
         return round_id
 
-    def getEvaluation(self, type_id, round_id, team):
+    def getEvaluation(self, type_id, round_id, team, cached=True):
         """ get feedback dict for type (cb,pov,poll) """
 
         if type_id not in ['cb', 'ids']:
             raise TiError('invalid evaluation type: %s' % type_id)
 
-        round_id = self.validate_round(round_id)
+        round_id = self.validate_round(round_id, cached)
 
         uri = "/round/%d/evaluation/%s/%s" % (round_id, type_id, team)
         status, reason, body = self._make_request(uri)
@@ -119,10 +436,10 @@ class TiClient(object):
 
         return data[type_id]
 
-    def getFeedback(self, feedback_type, round_id):
+    def getFeedback(self, feedback_type, round_id, cached=True):
         """ get feedback dict for type (cb,pov,poll) """
         
-        round_id = self.validate_round(round_id)
+        round_id = self.validate_round(round_id, cached)
         if feedback_type not in ['pov', 'cb', 'poll']:
             raise TiError('invalid feedback type: %s' % feedback_type)
 
@@ -137,9 +454,9 @@ class TiClient(object):
         
         return data[feedback_type]
 
-    def getScores(self, byscore=True):
+    def getScores(self, byscore=True, cached=True):
         """ get list of scores """
-        status = self.getStatus()
+        status = self.getStatus(cached)
         data = {}
 
         for team in status['scores']:
@@ -152,15 +469,72 @@ class TiClient(object):
 
         return ret
 
-    def _make_request(self, uri, fields=None, files=None):
+    def _make_request(self, uri, fields=None, files=None, hashes=None):
         """
         issues HTTP POST as multipart form data
         uri -- the uri location for POST
         fields -- sequence of (name,value) to encode into the form
-        files -- sequence of (name,filename,filedata) into the form
+        files -- sequence of (name,filename,path) where path is on the local filesystem
+        hashes -- optional dict updated with the SHA-256 of each file as sent
+        """
+
+        # GETs of a document fetched before ask the server to send it only
+        # if it changed
+        document = None
+        extra_headers = None
+        if fields is None:
+            with self.documents_lock:
+                document = self.documents.get(uri)
+            if document is not None:
+                extra_headers = {'If-None-Match': document[0]}
+
+        conn, rsp = self._open_request(uri, fields, files, hashes, extra_headers)
+
+        try:
+            data = rsp.read()
+        except socket.error as err:
+            conn.close()
+            raise TiError('unable to make request')
+        except httplib.HTTPException:
+            conn.close()
+            raise TiError('unknown error from server')
+
+        self._release(conn, rsp)
+
+        if fields is None:
+            if rsp.status == 304 and document is not None:
+                logging.debug("%s not modified", uri)
+                self._cache_document(uri, document)
+                return 200, 'OK', document[1]
+
+            etag = rsp.getheader('etag')
+            if rsp.status == 200 and etag is not None:
+                self._cache_document(uri, (etag, data))
+
+        return rsp.status, rsp.reason, data
+
+    def _cache_document(self, uri, document):
+        """ keeps (etag, body) of a fetched document, least recently used out """
+        if self.max_documents <= 0:
+            return
+
+        with self.documents_lock:
+            self.documents.pop(uri, None)
+            self.documents[uri] = document
+            while len(self.documents) > self.max_documents:
+                self.documents.popitem(last=False)
+
+    def _open_request(self, uri, fields=None, files=None, hashes=None,
+                      extra_headers=None):
+        """
+        issues an authenticated request, as _make_request
+        returns (conn, rsp) with the response body unread.  The caller must
+        read the body and then hand both to _release.
         """
 
         headers = {'User-Agent': 'ti-client'}
+        if extra_headers is not None:
+            headers.update(extra_headers)
 
         if fields is None:
             method = 'GET'
@@ -170,41 +544,100 @@ class TiClient(object):
             method = 'POST'
             content_type, sendbody = self._get_multipart_formdata(fields, files)
 
+        if self.challenge is None:
+            self._probe(method, uri, headers)
+
+        if 'Content-Type' not in headers:
+            headers['Content-Type'] = content_type
+
+        for attempt in range(2):
+            headers['Authorization'] = self._authorization(method, uri)
+
+            try:
+                conn, rsp = self._send(method, uri, sendbody, headers)
+            except socket.error as err:
+                raise TiError('unable to make request')
+            except httplib.HTTPException:
+                raise TiError('unknown error from server')
+
+            logging.debug("%s - %s", rsp.status, rsp.reason)
+
+            www_auth = rsp.getheader('www-authenticate')
+            if rsp.status != 401 or www_auth is None or attempt:
+                break
+
+            try:
+                rsp.read()
+                self._release(conn, rsp)
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+
+            # the cached nonce expired, wore out, or was forgotten by the
+            # server.  The challenge sent with the 401 replaces it, so no
+            # separate probe is needed.
+            logging.debug("renewing digest challenge")
+            self._set_challenge(www_auth)
+
+        if hashes is not None and sendbody is not None:
+            hashes.update(sendbody.hashes)
+
+        return conn, rsp
+
+    def _probe(self, method, uri, headers):
+        """
+        issues an unauthenticated request to obtain a digest auth challenge
+        """
         try:
-            conn = httplib.HTTPConnection(self.ti_server, self.ti_port)
-            conn.request(method, uri, '', headers)
-            rsp = conn.getresponse()
+            rsp, body = self._fetch(method, uri, '', dict(headers))
         except socket.error as err:
             raise TiError('unable to connect to server: %s:%s' % (self.ti_server, self.ti_port))
-        except httplib.BadStatusLine as err:
+        except httplib.HTTPException as err:
             raise TiError('invalid request from server')
 
-        body = rsp.read()
-
         if rsp.status != 401:
             logging.debug("%s - %s - %s", rsp.status, rsp.reason, repr(body))
             raise TiError('server did not return digest auth information')
 
-        parts = self._www_auth_parts(rsp.getheader('www-authenticate'))
+        self._set_challenge(rsp.getheader('www-authenticate'))
 
-        authorization = {}
+    def _set_challenge(self, www_auth):
+        """
+        caches the server's digest challenge, restarting the nonce count
+        www_auth -- the www-authenticate header from a 401 response
+        """
+        parts = self._www_auth_parts(www_auth)
+
+        challenge = {}
         if 'algorithm' in parts:
             if parts['algorithm'].lower() != 'md5':
                 raise TiError('unsupported digest algorithm')
             else:
-                authorization['algorithm'] = parts['algorithm']
+                challenge['algorithm'] = parts['algorithm']
 
         for field in ['realm', 'nonce', 'qop']:
-            authorization[field] = parts[field]
+            challenge[field] = parts[field]
       
         # optional parts that should be copied
         for field in ['opaque']:
             if field in parts:
-                authorization[field] = parts[field]
+                challenge[field] = parts[field]
+
+        with self.auth_lock:
+            self.challenge = challenge
+            self.nonce_count = 0
+
+    def _authorization(self, method, uri):
+        """
+        builds the Authorization header from the cached challenge, using the
+        next nonce count
+        """
+        with self.auth_lock:
+            self.nonce_count += 1
+            authorization = dict(self.challenge)
+            authorization['nc'] = "%08x" % self.nonce_count
 
         authorization['username'] = self.user
         authorization['uri'] = uri
-        authorization['nc'] = "00000001"
         authorization['cnonce'] = self._rand_str(4)
         
         authorization['response'] = self._gen_response(authorization, method)
@@ -213,43 +646,71 @@ class TiClient(object):
 
         logging.debug("# %s #", auth_string)
 
-        if 'Content-Type' not in headers:
-            headers['Content-Type'] = content_type
+        return auth_string
 
-        headers['Authorization'] = auth_string
+    def _send(self, method, uri, body, headers):
+        """
+        issues a single HTTP request over a pooled connection.  If a reused
+        connection was closed by the server while idle, the request is
+        retried once on a new connection.
+        returns (conn, rsp) with the response body unread
+        """
+        if isinstance(body, MultipartBody):
+            body.rewind()
 
+        conn, reused = self.pool.get()
         try:
-            conn.request(method, uri, sendbody, headers)
-            rsp = conn.getresponse()
-            data = rsp.read()
-        except socket.error as err:
-            raise TiError('unable to make request')
-        except httplib.BadStatusLine:
-            raise TiError('unknown error from server')
-
-        logging.debug("%s - %s", rsp.status, rsp.reason)
-
-        conn.close()
+            conn.request(method, uri, body, headers)
+            return conn, conn.getresponse()
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+        except Exception:
+            # such as a file of the body changing as it was sent, which
+            # leaves the connection half written
+            conn.close()
+            raise
+
+        logging.debug("reconnecting to %s:%s", self.ti_server, self.ti_port)
+        with self.pool.lock:
+            self.pool.reconnects += 1
+
+        if isinstance(body, MultipartBody):
+            body.rewind()
+
+        conn = self.pool.connect()
+        try:
+            conn.request(method, uri, body, headers)
+            return conn, conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+    def _release(self, conn, rsp):
+        """ return a connection to the pool once its response is read """
+        if rsp.will_close:
+            conn.close()
+        else:
+            self.pool.put(conn)
 
-        return rsp.status, rsp.reason, data
+    def _fetch(self, method, uri, body, headers):
+        """
+        issues a single HTTP request and reads the whole response
+        returns (rsp, body)
+        """
+        conn, rsp = self._send(method, uri, body, headers)
+        try:
+            data = rsp.read()
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            raise
+        self._release(conn, rsp)
+        return rsp, data
 
     def _get_multipart_formdata(self, fields, files):
         BOUNDARY = '------------------%s-cgc' % self._rand_str(8)
-        builder = []
-        for (name, value) in fields:
-            builder.append('--' + BOUNDARY)
-            builder.append('Content-Disposition: form-data; name="%s"' % name)
-            builder.append('')
-            builder.append(value)
-        for (name, filename, value) in files:
-            builder.append('--' + BOUNDARY)
-            builder.append('Content-Disposition: form-data; name="%s"; filename="%s"' % (name, filename))
-            builder.append('Content-Type: application/octet-stream')
-            builder.append('')
-            builder.append(value)
-        builder.append('--' + BOUNDARY + '--')
-        builder.append('')
-        body = '\r\n'.join(builder)
+        body = MultipartBody(BOUNDARY, fields, files)
 
         content_type = 'multipart/form-data; boundary=%s' % BOUNDARY
 
@@ -272,16 +733,12 @@ class TiClient(object):
         expected = {}
 
         for cbid, filename in files:
-            try:
-                with open(filename, 'rb') as f:
-                    filedata = f.read()
-            except IOError:
+            if not os.path.isfile(filename) or not os.access(filename, os.R_OK):
                 raise TiError('unable to open file: %s' % filename)
 
-            uploads.append((cbid, os.path.basename(filename), filedata))
-            expected[cbid] = hashlib.sha256(filedata).hexdigest()
+            uploads.append((cbid, os.path.basename(filename), filename))
 
-        status, reason, body = self._make_request('/rcb', fields, uploads)
+        status, reason, body = self._make_request('/rcb', fields, uploads, expected)
         
         try:
             response = json.loads(body)
@@ -310,13 +767,12 @@ class TiClient(object):
         if not os.path.isfile(filename):
             raise TiError('invalid filename: %s' % filename)
 
-        with open(filename, 'rb') as f:
-            filedata = f.read()
-            uploads.append(('file', os.path.basename(filename), filedata))
+        uploads.append(('file', os.path.basename(filename), filename))
+        hashes = {}
         
-        status, reason, body = self._make_request('/ids', fields, uploads)
+        status, reason, body = self._make_request('/ids', fields, uploads, hashes)
         
-        expected = hashlib.sha256(filedata).hexdigest()
+        expected = hashes.get('file')
         
         try:
             response = json.loads(body)
@@ -340,13 +796,12 @@ class TiClient(object):
         if not os.path.isfile(filename):
             raise TiError('invalid filename: %s' % filename)
 
-        with open(filename, 'rb') as f:
-            filedata = f.read()
-            uploads.append(('file', os.path.basename(filename), filedata))
+        uploads.append(('file', os.path.basename(filename), filename))
+        hashes = {}
         
-        status, reason, body = self._make_request('/pov', fields, uploads)
+        status, reason, body = self._make_request('/pov', fields, uploads, hashes)
         
-        expected = hashlib.sha256(filedata).hexdigest()
+        expected = hashes.get('file')
         
         try:
             response = json.loads(body)
@@ -363,7 +818,7 @@ class TiClient(object):
         
         return response['round']
 
-    def getConsensus(self, csid, data_type, team, round_id, output_dir):
+    def getConsensus(self, csid, data_type, team, round_id, output_dir, cached=True):
         if not os.path.isdir(output_dir):
             raise TiError('output directory is not a directory')
 
@@ -371,7 +826,7 @@ class TiClient(object):
         if data_type not in types:
             raise TiError('invalid consensus type')
 
-        response = self.getEvaluation(data_type, round_id, team)
+        response = self.getEvaluation(data_type, round_id, team, cached)
 
         paths = []
 
@@ -386,45 +841,150 @@ class TiClient(object):
         if not len(paths):
             raise TiError('invalid csid')
 
-        files = []
+        jobs = []
 
         for entry in paths:
             cbid, uri, checksum = entry
             filename = '%s-%s-%s.%s' % (cbid, team, round_id, data_type)
             path = os.path.join(output_dir, filename)
-            self._get_dl(uri, path, checksum)
-            files.append(path)
+            jobs.append((uri, path, checksum))
+
+        if len(jobs) > 1 and self.dl_workers > 1:
+            with self.dl_lock:
+                if self.dl_pool is None:
+                    self.dl_pool = ThreadPool(self.dl_workers)
+            files = self.dl_pool.map(self._get_consensus_file, jobs)
+        else:
+            files = map(self._get_consensus_file, jobs)
 
         files.sort()
 
         return files
 
+    def _get_consensus_file(self, job):
+        """
+        fetch one consensus file, from the download cache when possible
+        job -- (uri, path, checksum)
+        returns path
+        """
+        uri, path, checksum = job
+
+        if self.cache is None:
+            self._get_dl(uri, path, checksum)
+            return path
+
+        for _ in range(2):
+            cached = self.cache.get(checksum)
+            if cached is None:
+                self._get_dl(uri, self.cache.path(checksum), checksum)
+                cached = self.cache.add(checksum)
+
+            try:
+                self._materialize(cached, path)
+                return path
+            except OSError as err:
+                # evicted by another download before it could be linked, or
+                # removed from the cache directory by hand
+                if err.errno != errno.ENOENT:
+                    raise TiError('unable to write downloaded file')
+                self.cache.discard(checksum)
+
+        raise TiError('unable to write downloaded file')
+
+    def _materialize(self, source, filename):
+        """
+        atomically place a cached file at filename, by hardlink when source
+        and filename share a filesystem and by copy otherwise
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        tmpname = os.path.join(directory, '.%s.%s.part' % (os.path.basename(filename), self._rand_str(4)))
+
+        try:
+            os.link(source, tmpname)
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                raise
+            try:
+                shutil.copyfile(source, tmpname)
+            except (IOError, OSError) as err:
+                if os.path.exists(tmpname):
+                    os.remove(tmpname)
+                raise TiError('unable to write downloaded file')
+
+        try:
+            os.rename(tmpname, filename)
+        except OSError as err:
+            os.remove(tmpname)
+            raise TiError('unable to write downloaded file')
+
     def _get_dl(self, dlpath, filename, expected_checksum):
         """
         issues HTTP GET to retreive an eval item for a team
         dlpath - the uri for the file to download (e.g. /dl/2/cb/...)
+
+        The download is streamed into a temporary file next to filename,
+        hashed as it arrives, and only renamed into place once the checksum
+        matches, so filename is never left partially written.
         """
 
         assert dlpath.startswith("/dl/"), "bad download path"
         
-        status, reason, body = self._make_request(dlpath)
+        try:
+            handle, tmpname = create_file(os.path.dirname(os.path.abspath(filename)), '.', '.part')
+        except OSError as err:
+            raise TiError('unable to write downloaded file')
+
+        try:
+            conn, rsp = self._open_request(dlpath)
+        except TiError:
+            os.close(handle)
+            os.remove(tmpname)
+            raise
+
+        sha256 = hashlib.sha256()
+
+        try:
+            with os.fdopen(handle, 'wb') as w:
+                while True:
+                    block = rsp.read(self.block_size)
+                    if not block:
+                        break
+                    sha256.update(block)
+                    w.write(block)
+        except (socket.error, httplib.HTTPException) as err:
+            conn.close()
+            os.remove(tmpname)
+            raise TiError('unable to make request')
+        except (IOError, OSError) as err:
+            conn.close()
+            os.remove(tmpname)
+            raise TiError('unable to write downloaded file')
+
+        self._release(conn, rsp)
                 
-        checksum = hashlib.sha256(body).hexdigest()
+        checksum = sha256.hexdigest()
 
         if expected_checksum != checksum:
+            os.remove(tmpname)
             raise TiError('invalid download checksum.  Expected: %s Got: %s' % (expected_checksum, checksum))
 
         try:
-            with open(filename, "wb") as w:
-                w.write(body)
-        except IOError as err:
+            os.rename(tmpname, filename)
+        except OSError as err:
+            os.remove(tmpname)
             raise TiError('unable to write downloaded file')
 
-    def getStatus(self):
+    def getStatus(self, cached=True):
         """
         issues HTTP GET to retreive CGC CFE status (teams, scores, current round id)
+        cached -- reuse a status fetched within the last status_ttl seconds
         """
 
+        if cached:
+            entry = self.status_cache
+            if entry is not None and time.time() - entry[0] < self.status_ttl:
+                return entry[1]
+
         uri = "/status"
 
         status, reason, body = self._make_request(uri)
@@ -434,8 +994,19 @@ class TiClient(object):
         except ValueError:
             raise TiError('unable to parse server response')
 
+        self._cache_status(status)
+
         return status
 
+    def _cache_status(self, status):
+        """
+        caches a freshly fetched status.  A round change is only seen on the
+        next fetch, so a status may be served for up to status_ttl seconds
+        into the next round
+        """
+        if self.status_ttl > 0:
+            self.status_cache = (time.time(), status)
+
     def _www_auth_parts(self, www_auth):
         """
         splits apart the www-authenticate parts for digest auth
@@ -468,9 +1039,14 @@ class TiClient(object):
         auth_d -- dictionary of auth components required for response generation
         method -- the HTTP method (one of GET, POST)
         """
-        ha1 = hashlib.md5("%s:%s:%s" % (auth_d['username'],
-                                        auth_d['realm'],
-                                        self.password)).hexdigest()
+        # HA1 only depends on the credentials, so compute it once per realm
+        ha1 = self.ha1
+        if ha1 is None or ha1[0] != auth_d['realm']:
+            ha1 = (auth_d['realm'], hashlib.md5("%s:%s:%s" % (auth_d['username'],
+                                                             auth_d['realm'],
+                                                             self.password)).hexdigest())
+            self.ha1 = ha1
+        ha1 = ha1[1]
 
         ha2 = hashlib.md5("%s:%s" % (method, auth_d['uri'])).hexdigest()
 
@@ -478,3 +1054,95 @@ class TiClient(object):
                                                   auth_d['cnonce'],
                                                   auth_d['qop'],
                                                   ha2)).hexdigest()
+
+
+class AsyncTiClient(object):
+    """
+    Concurrent client for the CGC Team Interface.
+
+    Each call is issued on a bounded pool of worker threads sharing one
+    TiClient (and so one connection pool and digest auth session), and
+    returns a multiprocessing.pool.AsyncResult.  The fan-out helpers block
+    until every request they issue has completed.
+    """
+
+    def __init__(self, ti_server, ti_port, user, password, concurrency=8,
+                 status_ttl=1.0, cache_dir=None, cache_max_bytes=1024**3):
+        """
+        concurrency -- maximum number of requests in flight at once
+        status_ttl -- seconds a fetched /status may be reused, 0 disables
+        cache_dir -- directory for the consensus download cache, None disables
+        cache_max_bytes -- size cap of the consensus download cache
+        """
+        self.client = TiClient(ti_server, ti_port, user, password,
+                               max_idle=concurrency, status_ttl=status_ttl,
+                               cache_dir=cache_dir,
+                               cache_max_bytes=cache_max_bytes)
+        self.workers = ThreadPool(concurrency)
+
+    def close(self):
+        """ wait for outstanding requests and close idle connections """
+        self.workers.close()
+        self.workers.join()
+        self.client.close()
+
+    def _submit(self, func, *args):
+        return self.workers.apply_async(func, args)
+
+    def getStatus(self, cached=True):
+        return self._submit(self.client.getStatus, cached)
+
+    def getFeedback(self, feedback_type, round_id, cached=True):
+        return self._submit(self.client.getFeedback, feedback_type, round_id,
+                            cached)
+
+    def getEvaluation(self, type_id, round_id, team, cached=True):
+        return self._submit(self.client.getEvaluation, type_id, round_id,
+                            team, cached)
+
+    def getConsensus(self, csid, data_type, team, round_id, output_dir,
+                     cached=True):
+        return self._submit(self.client.getConsensus, csid, data_type, team,
+                            round_id, output_dir, cached)
+
+    def uploadRCB(self, csid, files):
+        return self._submit(self.client.uploadRCB, csid, files)
+
+    def uploadIDS(self, csid, filename):
+        return self._submit(self.client.uploadIDS, csid, filename)
+
+    def uploadPOV(self, csid, team, throws, filename):
+        return self._submit(self.client.uploadPOV, csid, team, throws,
+                            filename)
+
+    def getAllEvaluations(self, round_id, teams=None, types=('cb', 'ids')):
+        """
+        get every evaluation for a round concurrently
+        teams -- sequence of teams to fetch, defaults to every team
+        returns dict of (type, team) -> evaluation
+        """
+        if teams is None:
+            teams = self.client.getTeams()
+
+        # validate once up front rather than in every worker
+        round_id = self.client.validate_round(round_id)
+
+        jobs = []
+        for type_id in types:
+            for team in teams:
+                jobs.append(((type_id, team),
+                             self.getEvaluation(type_id, round_id, team)))
+
+        return dict((key, job.get()) for key, job in jobs)
+
+    def getAllFeedback(self, round_id, types=('cb', 'pov', 'poll')):
+        """
+        get every feedback type for a round concurrently
+        returns dict of type -> feedback
+        """
+        round_id = self.client.validate_round(round_id)
+
+        jobs = [(feedback_type, self.getFeedback(feedback_type, round_id))
+                for feedback_type in types]
+
+        return dict((key, job.get()) for key, job in jobs)
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+
+"""
+CGC - Team Interface file hashing
+
+Copyright (C) 2015 - Brian Caswell <bmc@lungetech.com>
+Copyright (C) 2015 - Tim <tim@0x90labs.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+# hashlib releases the GIL while hashing blocks this large, so files
+# hashed on separate threads are hashed on separate cores
+BLOCK_SIZE = 1 << 20
+
+
+def new_hash():
+    return hashlib.sha256()
+
+
+def read_blocks(infile, block_size=BLOCK_SIZE):
+    """ yields the rest of infile in blocks """
+    while True:
+        block = infile.read(block_size)
+        if not block:
+            break
+        yield block
+
+
+def hash_file(filename):
+    """ returns the hex SHA-256 of the file's contents """
+    sha256 = new_hash()
+    with open(filename, 'rb') as infile:
+        for block in read_blocks(infile):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def file_key(st):
+    """ (size, mtime_ns, inode) of a stat result, which change with the contents """
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(round(st.st_mtime * 1000000000))
+    return [st.st_size, mtime_ns, st.st_ino]
+
+
+class HashIndex(object):
+    """
+    SHA-256 of files keyed by path, size, mtime and inode, so files that
+    have not changed are never read again.  With a path, the index is
+    loaded from and saved to it as JSON.
+    """
+
+    def __init__(self, path=None, workers=None):
+        self.path = path
+        self.workers = workers
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self.load()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries)}
+
+    def load(self):
+        try:
+            with open(self.path) as infile:
+                entries = json.load(infile)
+        except (IOError, ValueError):
+            return
+        if isinstance(entries, dict):
+            self.entries = entries
+
+    def save(self):
+        """ write the index, dropping files that have changed or gone """
+        if self.path is None:
+            return
+        entries = {}
+        with self.lock:
+            for path, entry in self.entries.iteritems():
+                try:
+                    if file_key(os.stat(path)) == entry[:3]:
+                        entries[path] = entry
+                except OSError:
+                    pass
+        tmpname = '%s.%d' % (self.path, os.getpid())
+        with open(tmpname, 'w') as outfile:
+            json.dump(entries, outfile)
+        os.rename(tmpname, self.path)
+
+    def _lookup(self, path):
+        """ returns (hash or None, key) for path """
+        path = os.path.abspath(path)
+        key = file_key(os.stat(path))
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[:3] == key:
+                self.hits += 1
+                return entry[3], key
+            self.misses += 1
+        return None, key
+
+    def _hash(self, item):
+        path, key = item
+        checksum = hash_file(path)
+        with self.lock:
+            self.entries[os.path.abspath(path)] = key + [checksum]
+        return checksum
+
+    def hash_file(self, path):
+        checksum, key = self._lookup(path)
+        if checksum is None:
+            checksum = self._hash((path, key))
+        return checksum
+
+    def hash_files(self, paths):
+        """
+        returns a dict of path to hex SHA-256, hashing files not already
+        indexed on a pool of worker threads
+        """
+        result = {}
+        missing = []
+        for path in paths:
+            checksum, key = self._lookup(path)
+            if checksum is None:
+                missing.append((path, key))
+            else:
+                result[path] = checksum
+
+        if len(missing) > 1 and self.workers != 1:
+            pool = ThreadPool(self.workers)
+            try:
+                checksums = pool.map(self._hash, missing)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            checksums = [self._hash(item) for item in missing]
+
+        for (path, _), checksum in zip(missing, checksums):
+            result[path] = checksum
+        logging.debug('hashed %d files, %d already indexed', len(missing),
+                      len(result) - len(missing))
+        return result
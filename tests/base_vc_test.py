@@ -12,6 +12,7 @@ class VirtualCompetitionBase(object):
     virtual = True
     port = 1996
     server_process = None
+    server_args = []
 
     @classmethod
     def build_cb(cls):
@@ -46,17 +47,26 @@ class VirtualCompetitionBase(object):
         subprocess.check_output(['python', 'bin/ti-rotate', '--webroot', cls.webroot, '--roundlen=1', '--cbdir', cls.cbdir, '--rounds', '2'])
 
         if cls.virtual:
-            cmd = ['python', 'bin/ti-server', '--port', '%d' % cls.port, '--webroot', cls.webroot, '--cbdir', cls.cbdir]
-            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            handles = select.select([p.stdout, p.stderr], [], [])[0]
-            cls.server_process = p
+            cls.start_server()
         else:
             cls.server_process = None
 
     @classmethod
-    def tearDownClass(cls):
+    def start_server(cls):
+        cmd = ['python', 'bin/ti-server', '--port', '%d' % cls.port, '--webroot', cls.webroot, '--cbdir', cls.cbdir] + cls.server_args
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        handles = select.select([p.stdout, p.stderr], [], [])[0]
+        cls.server_process = p
+
+    @classmethod
+    def stop_server(cls):
         if cls.server_process is not None and cls.server_process.poll() is None:
             cls.server_process.terminate()
+            cls.server_process.wait()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stop_server()
 
         shutil.rmtree(cls.tmp_dir)
 
@@ -8,6 +8,8 @@ import subprocess
 
 sys.path.append('tests')
 import base_vc_test
+sys.path.insert(0, 'lib')
+import ticlient
 
 class TestClient(base_vc_test.VirtualCompetitionBase, unittest.TestCase):
 
@@ -301,6 +303,47 @@ class TestClient(base_vc_test.VirtualCompetitionBase, unittest.TestCase):
 
         self.assertEqual(cmd.stdout.read(1), '')
 
+    def test_consensus_cache_removed(self):
+        """ a file removed from the download cache is fetched again """
+        base_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        cache_dir = os.path.join(base_dir, 'cache')
+
+        client = ticlient.TiClient('localhost', self.port, 'vagrant', 'vagrant', cache_dir=cache_dir)
+        first = client.getConsensus('CADET_00003', 'cb', 1, 1, base_dir)
+        for name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, name))
+        os.remove(first[0])
+
+        self.assertEqual(first, client.getConsensus('CADET_00003', 'cb', 1, 1, base_dir))
+        subprocess.check_output(['cgcef_verify', first[0]])
+        self.assertEqual(1, client.cache.stats()['entries'])
+        client.close()
+
+    def test_upload_after_restart(self):
+        """ a large upload with a challenge cached before a restart is retried, not cut off """
+        valid_file = os.path.join(self.cbdir, 'CADET_00003', 'ids', 'CADET_00003.rules')
+        large_file = os.path.join(self.tmp_dir, 'large.rules')
+        with open(large_file, 'w') as outfile:
+            outfile.write(open(valid_file).read())
+            # well past what a server drains for a request it rejects
+            for _ in range(8 * 1024):
+                outfile.write('#' * 1023 + '\n')
+
+        client = ticlient.TiClient('localhost', self.port, 'vagrant', 'vagrant')
+        client.getRound(cached=False)
+
+        self.stop_server()
+        self.start_server()
+
+        round_id = client.uploadIDS('CADET_00003', large_file)
+        self.assertIsInstance(round_id, int)
+        client.close()
+
+
+class TestClientEvent(TestClient):
+    """ the same, against the event loop engine """
+    server_args = ['--engine', 'event']
+
 
 if __name__ == '__main__':
     unittest.main()
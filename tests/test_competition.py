@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 
+import httplib
 import json
 import os
 import sys
@@ -21,6 +22,18 @@ class VirtualCompetition(base_vc_test.VirtualCompetitionBase, unittest.TestCase)
         result = subprocess.check_output(cmd)
         return result
          
+    def test_keepalive(self):
+        """ auth challenges are framed so the connection can be reused """
+        conn = httplib.HTTPConnection('localhost', self.port)
+        for _ in range(3):
+            conn.request('GET', '/status')
+            rsp = conn.getresponse()
+            self.assertEqual(rsp.status, 401)
+            self.assertEqual(rsp.getheader('content-length'), '0')
+            self.assertEqual(rsp.read(), '')
+            self.assertFalse(rsp.will_close)
+        conn.close()
+
     def test_curl_status(self):
         """ tests /status is accessible (and auth) on default user/pass and port"""
         result = self._test_get_url('vagrant:vagrant', '/status')
@@ -0,0 +1,234 @@
+#!/usr/bin/python
+
+import imp
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+
+ti_rotate = imp.load_source('ti_rotate', 'bin/ti-rotate')
+run_phases = ti_rotate.run_phases
+
+
+class TestRunPhases(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ThreadPool(4)
+        self.lock = threading.Lock()
+        self.events = []
+
+    def tearDown(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def record(self, name, delay=0, error=None):
+        with self.lock:
+            self.events.append(('start', name))
+        time.sleep(delay)
+        with self.lock:
+            self.events.append(('end', name))
+        if error is not None:
+            raise error
+
+    def index(self, event, name):
+        return self.events.index((event, name))
+
+    def test_dependencies(self):
+        """ a phase starts only after every phase it depends on has ended """
+        run_phases(self.pool, {
+            'a': ((), self.record, ('a', 0.05)),
+            'b': ((), self.record, ('b', 0.01)),
+            'c': (('a', 'b'), self.record, ('c',)),
+            'd': (('c',), self.record, ('d',)),
+            'e': (('b',), self.record, ('e',)),
+        })
+        self.assertEqual(len(self.events), 10)
+        self.assertGreater(self.index('start', 'c'), self.index('end', 'a'))
+        self.assertGreater(self.index('start', 'c'), self.index('end', 'b'))
+        self.assertGreater(self.index('start', 'd'), self.index('end', 'c'))
+        self.assertGreater(self.index('start', 'e'), self.index('end', 'b'))
+        # independent phases run at once
+        self.assertLess(self.index('start', 'b'), self.index('end', 'a'))
+
+    def test_error(self):
+        """ the first error is raised once the phases running have ended """
+        with self.assertRaises(KeyError):
+            run_phases(self.pool, {
+                'fail': ((), self.record, ('fail', 0, KeyError('fail'))),
+                'slow': ((), self.record, ('slow', 0.1)),
+                'after': (('fail',), self.record, ('after',)),
+            })
+        self.assertIn(('end', 'slow'), self.events)
+        # nothing waiting on the failed phase is started
+        self.assertNotIn(('start', 'after'), self.events)
+
+    def test_unmet(self):
+        """ phases depending on ones that do not exist are reported """
+        with self.assertRaises(ValueError) as context:
+            run_phases(self.pool, {
+                'a': ((), self.record, ('a',)),
+                'b': (('missing',), self.record, ('b',)),
+                'c': (('b',), self.record, ('c',)),
+            })
+        self.assertIn('b, c', str(context.exception))
+        self.assertEqual(self.events, [('start', 'a'), ('end', 'a')])
+
+    def test_slow_phase(self):
+        """ a phase running longer than PHASE_WAIT is still waited for """
+        wait = ti_rotate.PHASE_WAIT
+        ti_rotate.PHASE_WAIT = 0.01
+        try:
+            run_phases(self.pool, {
+                'slow': ((), self.record, ('slow', 0.1)),
+                'next': (('slow',), self.record, ('next',)),
+            })
+        finally:
+            ti_rotate.PHASE_WAIT = wait
+        self.assertEqual(self.events, [('start', 'slow'), ('end', 'slow'),
+                                       ('start', 'next'), ('end', 'next')])
+
+
+
+class TestIssue(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = ti_rotate.mutate_rcb, ti_rotate.random.randrange
+        ti_rotate.mutate_rcb = lambda path, team, store: (path + '-%d' % team, 'hash')
+        # every team is given something each round
+        ti_rotate.random.randrange = lambda stop: 0
+
+    def tearDown(self):
+        ti_rotate.mutate_rcb, ti_rotate.random.randrange = self.saved
+
+    def test_rcb_donors(self):
+        """ RCBs are taken only from teams with CBs installed """
+        rotator = ti_rotate.Rotator.__new__(ti_rotate.Rotator)
+        rotator.round_num = 1
+        rotator.teams = range(1, 8)
+        rotator.my_team = 1
+        rotator.store = None
+        rotator.installed_filters = dict((team, {'CADET_00003': {'path': 'filter'}})
+                                         for team in rotator.teams)
+        rotator.installed_cbs = dict((team, {}) for team in rotator.teams)
+        for team in [2, 3]:
+            rotator.installed_cbs[team]['CADET_00003'] = {'csid': 'CADET_00003', 'path': 'cb%d' % team}
+
+        rotator.issue_rcbs()
+        for team in range(2, 8):
+            path = rotator.installed_cbs[team]['CADET_00003']['path']
+            self.assertTrue(path.startswith('cb') and path.endswith('-%d' % team), path)
+
+
+class FakeClock(object):
+    """ stands in for the time module in ti-rotate """
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def ctime(self, seconds=None):
+        return time.ctime(seconds)
+
+
+class TestRounds(unittest.TestCase):
+    """ round boundaries, with each round's work taking the time in work """
+
+    start = 1000000.5
+
+    def setUp(self):
+        self.clock = FakeClock(self.start)
+        self.clock_module = ti_rotate.time
+        ti_rotate.time = self.clock
+        logging.disable(logging.WARNING)
+        self.web_root = tempfile.mkdtemp()
+        self.pool = ThreadPool(1)
+
+    def tearDown(self):
+        ti_rotate.time = self.clock_module
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.web_root)
+        self.pool.terminate()
+        self.pool.join()
+
+    def rotator(self, overrun, work):
+        """ a Rotator whose rounds do nothing but take time """
+        rotator = ti_rotate.Rotator.__new__(ti_rotate.Rotator)
+        rotator.round_length = 10
+        rotator.overrun = overrun
+        rotator.web_root = self.web_root
+        rotator.round_num = 0
+        rotator.round_end = 0
+        rotator.teams = [1, 2]
+        rotator.pool = self.pool
+        rotator.rounds = []
+
+        def build():
+            self.clock.sleep(work[rotator.round_num])
+
+        def finish(path):
+            rotator.rounds.append((rotator.round_time, rotator.round_end))
+
+        nothing = lambda *args: None
+        rotator.distribute_rcb = build
+        rotator.distribute_ids = rotator.distribute_pov = rotator.update_scores = nothing
+        rotator.write_consensus_rcb = rotator.write_consensus_ids = nothing
+        rotator.write_round_num = rotator.write_status = nothing
+        rotator.write_poll_feedback = rotator.write_pov_feedback = nothing
+        rotator.write_cb_feedback = finish
+        return rotator
+
+    def rounds(self, overrun, work):
+        rotator = self.rotator(overrun, work)
+        rotator.run(len(work))
+        start = int(self.start)
+        return [(begin - start, end - self.start) for begin, end in rotator.rounds]
+
+    def test_on_time(self):
+        for overrun in ['skip', 'catchup']:
+            self.clock.now = self.start
+            self.assertEqual(self.rounds(overrun, [1, 9.5, 0]),
+                             [(0, 10), (10, 20), (20, 30)])
+
+    def test_skip(self):
+        """ a round overrunning its end is extended to the next boundary ahead """
+        self.assertEqual(self.rounds('skip', [1, 25, 0, 10]),
+                         [(0, 10), (10, 40), (40, 50), (50, 60)])
+
+    def test_skip_boundary(self):
+        """ a round ending just past a boundary skips only that one """
+        self.assertEqual(self.rounds('skip', [10.25, 0]),
+                         [(0, 20), (20, 30)])
+
+    def test_catchup(self):
+        """ rounds keep their boundaries, those after an overrun are cut short """
+        self.assertEqual(self.rounds('catchup', [1, 25, 0, 0, 0]),
+                         [(0, 10), (10, 35), (35, 35), (35, 40), (40, 50)])
+
+    def test_catchup_no_overlap(self):
+        """ each round starts once the one before it has ended """
+        rounds = self.rounds('catchup', [1, 25, 3, 1, 12, 0, 0])
+        for (_, end), (begin, _) in zip(rounds, rounds[1:]):
+            self.assertGreaterEqual(begin, int(end))
+        # and the schedule is met again
+        self.assertEqual((60, 70), rounds[-1])
+
+    def test_end_of_round(self):
+        rotator = self.rotator('skip', [])
+        self.assertEqual(rotator.end_of_round(100, 0, 105), (0, 110))
+        self.assertEqual(rotator.end_of_round(100, 0, 110), (0, 110))
+        self.assertEqual(rotator.end_of_round(100, 0, 110.5), (1, 120))
+        self.assertEqual(rotator.end_of_round(100, 2, 151), (5, 160))
+        rotator.overrun = 'catchup'
+        self.assertEqual(rotator.end_of_round(100, 2, 151), (2, 130))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,660 @@
+#!/usr/bin/python
+
+import StringIO
+import distutils.spawn
+import glob
+import hashlib
+import imp
+import json
+import mimetools
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ti_server = imp.load_source('ti_server', 'bin/ti-server')
+sys.path.insert(0, 'lib')
+import ticlient
+NonceStore = ti_server.NonceStore
+MultipartForm = ti_server.MultipartForm
+MultipartError = ti_server.MultipartError
+
+
+def form_body(boundary, parts, preamble='', epilogue='\r\n'):
+    """ encode parts, a list of (name, filename or None, value) """
+    body = preamble
+    for name, filename, value in parts:
+        disposition = 'form-data; name="%s"' % name
+        if filename is not None:
+            disposition += '; filename="%s"' % filename
+        body += '--%s\r\nContent-Disposition: %s\r\n\r\n%s\r\n' % (boundary, disposition, value)
+    return body + '--%s--%s' % (boundary, epilogue)
+
+
+class TestNonceStore(unittest.TestCase):
+
+    def test_use(self):
+        store = NonceStore()
+        nonce, opaque = store.issue()
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '00000001'))
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '00000002'))
+        self.assertEqual(1, len(store))
+        self.assertEqual({'issued': 1, 'used': 2, 'expired': 0, 'evicted': 0, 'size': 1},
+                         store.stats())
+
+    def test_replay(self):
+        store = NonceStore()
+        nonce, opaque = store.issue()
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '00000001'))
+        self.assertEqual(NonceStore.INVALID, store.use(nonce, opaque, '00000001'))
+        self.assertEqual(NonceStore.INVALID, store.use(nonce, opaque, '00000000'))
+        self.assertEqual(NonceStore.INVALID, store.use(nonce, opaque, 'zz'))
+
+    def test_window(self):
+        """ counts may arrive out of order, but each only once """
+        store = NonceStore()
+        nonce, opaque = store.issue()
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '%08x' % 5))
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '%08x' % 3))
+        self.assertEqual(NonceStore.INVALID, store.use(nonce, opaque, '%08x' % 3))
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '%08x' % 4))
+        self.assertEqual(NonceStore.INVALID, store.use(nonce, opaque, '%08x' % 5))
+
+        highest = 5 + ti_server.NC_WINDOW
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '%08x' % highest))
+        self.assertEqual(NonceStore.INVALID, store.use(nonce, opaque, '%08x' % (highest - ti_server.NC_WINDOW)))
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '%08x' % (highest - ti_server.NC_WINDOW + 1)))
+
+    def test_expired(self):
+        store = NonceStore()
+        nonce, opaque = store.issue()
+        store.lifetime = -1
+        self.assertEqual(NonceStore.STALE, store.use(nonce, opaque, '00000001'))
+        self.assertEqual(1, store.stats()['expired'])
+        store.lifetime = 300
+        self.assertEqual(0, len(store))
+        self.assertEqual(NonceStore.STALE, store.use(nonce, opaque, '00000002'))
+
+    def test_worn_out(self):
+        store = NonceStore(max_uses=2)
+        nonce, opaque = store.issue()
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '00000002'))
+        self.assertEqual(NonceStore.STALE, store.use(nonce, opaque, '00000003'))
+
+    def test_unknown(self):
+        """ nonces from before a restart are stale, forged opaques invalid """
+        store = NonceStore()
+        nonce, opaque = NonceStore().issue()
+        self.assertEqual(NonceStore.STALE, store.use(nonce, opaque, '00000001'))
+        self.assertEqual(NonceStore.STALE, store.use('abc', opaque, '00000001'))
+
+        nonce, opaque = store.issue()
+        self.assertEqual(NonceStore.INVALID, store.use(nonce, '0' * 32, '00000001'))
+
+    def test_evicted(self):
+        """ a nonce that lost its slot is stale, not accepted again """
+        store = NonceStore(max_nonces=1)
+        first, first_opaque = store.issue()
+        self.assertEqual(NonceStore.VALID, store.use(first, first_opaque, '00000001'))
+        second, second_opaque = store.issue()
+        self.assertEqual(1, store.stats()['evicted'])
+        self.assertEqual(1, len(store))
+        self.assertEqual(NonceStore.STALE, store.use(first, first_opaque, '00000001'))
+        self.assertEqual(NonceStore.STALE, store.use(first, first_opaque, '00000002'))
+        self.assertEqual(NonceStore.VALID, store.use(second, second_opaque, '00000001'))
+
+    def test_shared(self):
+        """ counts used by one forked worker can not be replayed on another """
+        store = NonceStore()
+        nonce, opaque = store.issue()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(store.use(nonce, opaque, '00000001') != NonceStore.VALID)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertEqual(NonceStore.INVALID, store.use(nonce, opaque, '00000001'))
+        self.assertEqual(NonceStore.VALID, store.use(nonce, opaque, '00000002'))
+
+    def test_shared_stats(self):
+        """ every worker reports the counts of all of them """
+        store = NonceStore()
+        nonce, opaque = store.issue()
+        pid = os.fork()
+        if pid == 0:
+            store.issue()
+            store.use(nonce, opaque, '00000001')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        store.use(nonce, opaque, '00000002')
+        stats = store.stats()
+        self.assertEqual(2, stats['issued'])
+        self.assertEqual(2, stats['used'])
+        self.assertEqual(2, stats['size'] + stats['evicted'])
+
+
+class TestValidationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'verdicts')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def lines(self):
+        with open(self.path) as infile:
+            return infile.readlines()
+
+    def test_persisted(self):
+        cache = ti_server.ValidationCache(4, self.path)
+        self.assertTrue(cache.validate('a', lambda: True))
+        self.assertFalse(cache.validate('b', lambda: False))
+
+        cache = ti_server.ValidationCache(4, self.path)
+        self.assertTrue(cache.validate('a', self.fail))
+        self.assertFalse(cache.validate('b', self.fail))
+        self.assertEqual(2, cache.stats()['hits'])
+
+    def test_error_not_cached(self):
+        """ a check that fails to run is tried again, and not saved """
+        cache = ti_server.ValidationCache(4, self.path)
+
+        def missing():
+            raise OSError(2, 'No such file or directory')
+        self.assertRaises(OSError, cache.validate, 'a', missing)
+        self.assertTrue(cache.validate('a', lambda: True))
+        self.assertEqual(1, len(self.lines()))
+
+    def test_compacted(self):
+        """ the file is rewritten once it holds twice max_entries lines """
+        cache = ti_server.ValidationCache(4, self.path)
+        for i in range(100):
+            cache.validate(str(i), lambda: True)
+            self.assertLessEqual(len(self.lines()), 8)
+        self.assertEqual(['96', '97', '98', '99'],
+                         [json.loads(line)[0] for line in self.lines()][-4:])
+
+    def test_cgcef_verify_missing(self):
+        path = os.environ['PATH']
+        os.environ['PATH'] = self.directory
+        try:
+            self.assertRaises(OSError, ti_server.TeamInterfaceHandler.run_cgcef_verify, '/bin/sh')
+        finally:
+            os.environ['PATH'] = path
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram_order(self):
+        metrics = ti_server.Metrics({'ti_seconds': ('histogram', 'Time')})
+        metrics.observe('ti_seconds', 3, (('route', 'b'),))
+        metrics.observe('ti_seconds', 0.2, (('route', 'a'),))
+        lines = metrics.render().splitlines()
+
+        self.assertEqual(['# HELP ti_seconds Time', '# TYPE ti_seconds histogram'], lines[:2])
+        series = len(ti_server.Metrics.BUCKETS) + 3
+        for route, lines in [('a', lines[2:2 + series]), ('b', lines[2 + series:])]:
+            bounds = [line.split('le="')[1].split('"')[0] for line in lines[:-2]]
+            self.assertEqual([str(bound) for bound in ti_server.Metrics.BUCKETS] + ['+Inf'], bounds)
+            self.assertTrue(lines[-2].startswith('ti_seconds_sum{route="%s"}' % route))
+            self.assertTrue(lines[-1].startswith('ti_seconds_count{route="%s"} 1' % route))
+
+    def test_counters_and_samples(self):
+        metrics = ti_server.Metrics()
+        metrics.inc('ti_total', (('code', 404),))
+        metrics.inc('ti_total', (('code', 200),), 2)
+        text = metrics.render([('ti_total', (('code', 500),), 1), ('ti_size', (), 7)])
+        self.assertEqual(['ti_size 7', 'ti_total{code="200"} 2', 'ti_total{code="404"} 1',
+                          'ti_total{code="500"} 1'], text.splitlines())
+
+
+class TestMultipartForm(unittest.TestCase):
+
+    boundary = 'xYzZY'
+    content_type = 'multipart/form-data; boundary=xYzZY'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def parse(self, body, block_size=65536, length=None):
+        if length is None:
+            length = len(body)
+        return MultipartForm(StringIO.StringIO(body), self.content_type, length,
+                             self.directory, block_size)
+
+    def staged(self):
+        return [x for x in os.listdir(self.directory) if x.startswith(ti_server.UPLOAD_PREFIX)]
+
+    def test_fields_and_files(self):
+        # file data full of near misses for the delimiter
+        data = 'ELF\r\n--xYz\r\n--xYzZ\r\n-\r\n--xYzZy' * 100 + '\r\n--xYzZ'
+        body = form_body(self.boundary, [('csid', None, 'CADET_00003'),
+                                         ('CADET_00003', 'a.out', data),
+                                         ('csid', None, 'again')])
+
+        # one byte at a time splits every delimiter across reads
+        for block_size in [1, 3, 7, 64, 65536]:
+            form = self.parse(body, block_size)
+            self.assertEqual(['csid', 'CADET_00003'], form.keys())
+            self.assertEqual(['CADET_00003', 'again'], [x.value for x in form['csid']])
+
+            part = form['CADET_00003']
+            self.assertEqual('a.out', part.filename)
+            self.assertEqual(len(data), part.size)
+            self.assertEqual(hashlib.sha256(data).hexdigest(), part.hash)
+            with open(part.path, 'rb') as infile:
+                self.assertEqual(data, infile.read())
+
+            form.cleanup()
+            self.assertEqual([], self.staged())
+
+    def test_preamble_and_epilogue(self):
+        body = form_body(self.boundary, [('csid', None, 'CADET_00003')],
+                         preamble='ignored\r\n', epilogue='')
+        for block_size in [1, 65536]:
+            form = self.parse(body, block_size)
+            self.assertEqual('CADET_00003', form['csid'].value)
+
+        body = form_body(self.boundary, [('csid', None, 'x')], epilogue='\r\nignored')
+        self.assertEqual('x', self.parse(body)['csid'].value)
+
+    def test_empty_file(self):
+        form = self.parse(form_body(self.boundary, [('file', 'empty', '')]))
+        self.assertEqual(0, form['file'].size)
+        self.assertEqual(hashlib.sha256('').hexdigest(), form['file'].hash)
+        form.cleanup()
+
+    def test_file_mode(self):
+        """ staged files are created subject to the umask """
+        umask = os.umask(027)
+        try:
+            form = self.parse(form_body(self.boundary, [('file', 'a', 'data')]))
+        finally:
+            os.umask(umask)
+        self.assertEqual(0640, os.stat(form['file'].path).st_mode & 0777)
+        form.cleanup()
+
+    def test_malformed(self):
+        body = form_body(self.boundary, [('csid', None, 'x')])
+        bad = [
+            ('text/plain', body),
+            ('multipart/form-data', body),
+            (self.content_type, body[:-10]),
+            (self.content_type, 'no boundary here'),
+            (self.content_type, body.replace('Content-Disposition', 'Content-Type')),
+            (self.content_type, body.replace('Content-Disposition: ', 'broken')),
+        ]
+        for content_type, data in bad:
+            self.assertRaises(MultipartError, MultipartForm, StringIO.StringIO(data),
+                              content_type, len(data), self.directory)
+
+    def test_limits(self):
+        files = [('file', 'f%d' % i, 'data') for i in range(ti_server.MAX_FILES + 1)]
+        self.assertRaises(MultipartError, self.parse, form_body(self.boundary, files))
+        self.assertEqual([], self.staged())
+
+        field = [('csid', None, 'x' * (ti_server.MAX_FIELD + 1))]
+        self.assertRaises(MultipartError, self.parse, form_body(self.boundary, field))
+
+    def test_max_size(self):
+        """ a file is refused as soon as it passes max_size """
+        data = 'x' * 1000
+        body = form_body(self.boundary, [('file', 'a', data)]) + 'y' * 10000
+        rfile = StringIO.StringIO(body)
+        self.assertRaises(MultipartError, MultipartForm, rfile, self.content_type,
+                          len(body), self.directory, 64, 999)
+        self.assertLess(rfile.tell(), 1200)
+        self.assertEqual([], self.staged())
+
+        form = MultipartForm(StringIO.StringIO(body), self.content_type, len(body),
+                             self.directory, 64, 1000)
+        self.assertEqual(1000, form['file'].size)
+        form.cleanup()
+
+    def test_cleanup_on_error(self):
+        """ files staged before an error are removed """
+        body = form_body(self.boundary, [('first', 'a', 'x' * 1000), ('second', 'b', 'y' * 1000)])
+        for cut in [len(body) / 2, len(body) - 20]:
+            self.assertRaises(MultipartError, self.parse, body[:cut], 64, len(body))
+            self.assertEqual([], self.staged())
+
+
+class FormHandler(ti_server.BufferedHandler):
+    """ a handler set up by hand, without a request """
+
+    def __init__(self):
+        pass
+
+    def log_message(self, *args):
+        pass
+
+
+class TestGetForm(unittest.TestCase):
+    """ TeamInterfaceHandler.get_form answers bad uploads with a 400 and a close """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'rcb'))
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def get_form(self, body, max_size=1024, max_files=1, length=None):
+        if length is None:
+            length = len(body)
+        head = ('Content-Type: multipart/form-data; boundary=xYzZY\r\n'
+                'Content-Length: %d\r\n\r\n' % length)
+        handler = FormHandler()
+        handler.headers = mimetools.Message(StringIO.StringIO(head))
+        handler.rfile = StringIO.StringIO(body)
+        handler.wfile = StringIO.StringIO()
+        handler.path = '/rcb'
+        handler.command = 'POST'
+        handler.request_version = 'HTTP/1.1'
+        handler.requestline = 'POST /rcb HTTP/1.1'
+        handler.client_address = ('127.0.0.1', 0)
+        handler.close_connection = 0
+        handler.bytes_out = 0
+        form = handler.get_form(max_size, max_files)
+        return handler, form
+
+    def assertRejected(self, handler, form):
+        self.assertIsNone(form)
+        self.assertEqual(400, handler.status_code)
+        self.assertEqual(1, handler.close_connection)
+        self.assertIn('malformed request', handler.wfile.getvalue())
+        self.assertEqual([], os.listdir('rcb'))
+
+    def test_valid(self):
+        handler, form = self.get_form(form_body('xYzZY', [('CADET_00003', 'cb', 'data')]))
+        self.assertEqual('data', open(form['CADET_00003'].path).read())
+        self.assertEqual(0, handler.close_connection)
+        form.cleanup()
+
+    def test_declared_too_large(self):
+        """ refused from Content-Length alone, without reading the body """
+        length = 1024 * 3 + ti_server.MAX_FORM_OVERHEAD + 1
+        handler, form = self.get_form('', max_files=3, length=length)
+        self.assertRejected(handler, form)
+        self.assertEqual(0, handler.rfile.tell())
+
+    def test_too_many_files(self):
+        files = [('file', 'f%d' % i, 'data') for i in range(ti_server.MAX_FILES + 1)]
+        self.assertRejected(*self.get_form(form_body('xYzZY', files), max_files=32))
+
+    def test_file_too_large(self):
+        """ refused once the file passes max_size, before the rest is written """
+        data = 'x' * 4096
+        body = form_body('xYzZY', [('csid', None, 'x'), ('CADET_00003', 'cb', data)])
+        self.assertRejected(*self.get_form(body, max_size=1024, max_files=4))
+
+        handler, form = self.get_form(form_body('xYzZY', [('CADET_00003', 'cb', data[:1024])]))
+        self.assertEqual(1024, form['CADET_00003'].size)
+        form.cleanup()
+
+    def test_field_too_large(self):
+        field = [('csid', None, 'x' * (ti_server.MAX_FIELD + 1))]
+        self.assertRejected(*self.get_form(form_body('xYzZY', field), max_size=ti_server.MAX_FIELD))
+
+    def test_truncated(self):
+        body = form_body('xYzZY', [('first', 'a', 'x' * 1000), ('second', 'b', 'y')])
+        self.assertRejected(*self.get_form(body[:len(body) / 2], length=len(body)))
+
+
+class TestEventEngine(unittest.TestCase):
+    """ the event loop engine, serving a webroot from a thread """
+
+    idle_timeout = 1
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.directory = tempfile.mkdtemp()
+        os.chdir(cls.directory)
+        for directory in ['rcb', 'pov', 'ids', 'dl/1/cb']:
+            os.makedirs(directory)
+        with open('status', 'w') as outfile:
+            json.dump({'round': 1, 'scores': []}, outfile)
+
+        # large enough to outlast the socket buffers when read slowly
+        cls.download = os.urandom(1024 * 1024) * 64
+        with open('dl/1/cb/LARGE_00001', 'wb') as outfile:
+            outfile.write(cls.download)
+
+        handler = ti_server.TeamInterfaceHandler
+        cls.saved = handler.config, ti_server.BufferedHandler.log_message
+        challenges = {'CADET_00003': 1}
+        handler.config = {'challenges': challenges,
+                          'cbids': ti_server.expand_cbids(challenges),
+                          'realm': 'CGC', 'team': 1, 'max_ids': 8 * 1024 * 1024,
+                          'max_rcb': 1024, 'max_pov': 1024, 'validator': 'native'}
+        ti_server.BufferedHandler.log_message = lambda self, *args: None
+        ti_server.add_auth('.htdigest', 'CGC', 'vagrant', 'vagrant')
+
+        cls.server = ti_server.EventServer(('127.0.0.1', 0), handler, 2, cls.idle_timeout)
+        cls.port = cls.server.socket.getsockname()[1]
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        ti_server.TeamInterfaceHandler.config, ti_server.BufferedHandler.log_message = cls.saved
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.client = ticlient.TiClient('127.0.0.1', self.port, 'vagrant', 'vagrant')
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_keepalive(self):
+        for _ in range(5):
+            self.assertEqual(1, self.client.getStatus(cached=False)['round'])
+        stats = self.client.pool_stats()
+        self.assertEqual(0, stats['reconnects'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_download(self):
+        path = os.path.join(self.directory, 'download')
+        self.client._get_dl('/dl/1/cb/LARGE_00001', path,
+                            hashlib.sha256(self.download).hexdigest())
+        os.remove(path)
+
+    def test_slow_download(self):
+        """ a download still being taken is not closed as idle """
+        conn, rsp = self.client._open_request('/dl/1/cb/LARGE_00001')
+        self.assertEqual(200, rsp.status)
+        data = []
+        while True:
+            block = rsp.read(4 * 1024 * 1024)
+            if not block:
+                break
+            data.append(block)
+            time.sleep(0.25)
+        self.client._release(conn, rsp)
+        self.assertTrue(''.join(data) == self.download)
+
+    def test_post(self):
+        """ a body larger than the engine buffers is read, and the connection kept """
+        path = os.path.join(self.directory, 'large.rules')
+        with open(path, 'w') as outfile:
+            for _ in range(4 * 1024):
+                outfile.write('#' * 1023 + '\n')
+        with self.assertRaises(ticlient.TiError) as context:
+            self.client.uploadIDS('NOSUCH_00001', path)
+        self.assertIn('invalid csid', str(context.exception))
+        self.assertEqual(1, self.client.getStatus(cached=False)['round'])
+        self.assertEqual(1, self.client.pool_stats()['misses'])
+        os.remove(path)
+
+    def post_head(self, length, authorization=None):
+        head = ('POST /ids HTTP/1.1\r\nHost: localhost\r\n'
+                'Content-Type: multipart/form-data; boundary=xYzZY\r\n'
+                'Content-Length: %d\r\n' % length)
+        if authorization is not None:
+            head += 'Authorization: %s\r\n' % authorization
+        return head + '\r\n'
+
+    def test_unauthenticated_post(self):
+        """ refused without the body being read """
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        sock.settimeout(5)
+        sock.sendall(self.post_head(100 * 1024 * 1024))
+        block = 'x' * 65536
+        sent = 0
+        try:
+            while sent < 100 * 1024 * 1024:
+                sent += sock.send(block)
+        except socket.error:
+            pass
+        response = sock.recv(65536)
+        sock.close()
+        self.assertTrue(response.startswith('HTTP/1.1 401'))
+        self.assertLess(sent, 16 * 1024 * 1024)
+
+    def test_close_mid_body(self):
+        """ a client going away part way through a body leaves nothing behind """
+        self.client.getStatus(cached=False)
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        sock.sendall(self.post_head(10 * 1024 * 1024, self.client._authorization('POST', '/ids')))
+        sock.sendall('--xYzZY\r\nContent-Disposition: form-data; name="csid"\r\n\r\nCADET_00003\r\n'
+                     '--xYzZY\r\nContent-Disposition: form-data; name="file"; filename="a"\r\n\r\n')
+        sock.sendall('#' * 1024 * 1024)
+        sock.close()
+
+        for _ in range(50):
+            if not os.listdir('ids'):
+                break
+            time.sleep(0.1)
+        self.assertEqual([], os.listdir('ids'))
+        self.assertEqual(1, self.client.getStatus(cached=False)['round'])
+
+
+def make_cgcef(header=None, phdrs=None, size=None):
+    """
+    a minimal CGC executable with one loadable segment, with fields of the
+    header and of each program header replaced from the dicts given
+    """
+    code = '\x31\xc0\x40\xcd\x80' + '\x90' * 11
+    phoff = ti_server.CGCEF_HEADER.size
+    length = phoff + ti_server.CGCEF_PHDR.size + len(code)
+
+    fields = {'ident': ti_server.CGCEF_IDENT, 'type': ti_server.ET_EXEC,
+              'machine': ti_server.EM_386, 'version': ti_server.EV_CURRENT,
+              'entry': 0x8048000 + length - len(code), 'phoff': phoff,
+              'ehsize': ti_server.CGCEF_HEADER.size,
+              'phentsize': ti_server.CGCEF_PHDR.size, 'phnum': 1}
+    fields.update(header or {})
+    image = ti_server.CGCEF_HEADER.pack(
+        fields['ident'], fields['type'], fields['machine'], fields['version'],
+        fields['entry'], fields['phoff'], 0, 0, fields['ehsize'],
+        fields['phentsize'], fields['phnum'], 40, 0, 0)
+
+    for phdr in phdrs or [{}]:
+        segment = {'type': ti_server.PT_LOAD, 'offset': 0, 'vaddr': 0x8048000,
+                   'filesz': length, 'memsz': length}
+        segment.update(phdr)
+        image += ti_server.CGCEF_PHDR.pack(
+            segment['type'], segment['offset'], segment['vaddr'], segment['vaddr'],
+            segment['filesz'], segment['memsz'], 5, 0x1000)
+
+    image += code
+    if size is not None:
+        image = image[:size]
+    return image
+
+
+class TestCheckCgcef(unittest.TestCase):
+
+    valid = {
+        'minimal': make_cgcef(),
+        'phdr': make_cgcef(phdrs=[{'type': ti_server.PT_PHDR, 'offset': 52, 'filesz': 64, 'memsz': 64},
+                                  {'type': ti_server.PT_LOAD}],
+                           header={'phnum': 2, 'entry': 0x8048000 + 116}),
+        'pov2': make_cgcef(phdrs=[{}, {'type': ti_server.PT_CGCPOV2, 'filesz': 0, 'memsz': 0}],
+                           header={'phnum': 2, 'entry': 0x8048000 + 116}),
+        'bss': make_cgcef(phdrs=[{'memsz': 0x10000}]),
+        'null': make_cgcef(phdrs=[{}, {'type': ti_server.PT_NULL}],
+                           header={'phnum': 2, 'entry': 0x8048000 + 116}),
+    }
+
+    invalid = {
+        'empty': '',
+        'short': make_cgcef(size=40),
+        'elf': make_cgcef(header={'ident': '\x7fELF\x01\x01\x01\x00'}),
+        'ident': make_cgcef(header={'ident': '\x7fCGC\x02\x01\x01\x43\x01'}),
+        'type': make_cgcef(header={'type': 3}),
+        'machine': make_cgcef(header={'machine': 62}),
+        'version': make_cgcef(header={'version': 0}),
+        'ehsize': make_cgcef(header={'ehsize': 64}),
+        'phentsize': make_cgcef(header={'phentsize': 56}),
+        'phnum': make_cgcef(header={'phnum': 0}),
+        'phoff': make_cgcef(header={'phoff': 0x1000}),
+        'p_type': make_cgcef(phdrs=[{'type': 4}]),
+        'segment_eof': make_cgcef(phdrs=[{'filesz': 0x1000, 'memsz': 0x1000}]),
+        'filesz': make_cgcef(phdrs=[{'memsz': 10}]),
+        'address_space': make_cgcef(phdrs=[{'vaddr': 0xfffff000, 'memsz': 0x2000}]),
+    }
+
+    def test_valid(self):
+        for name, image in self.valid.items():
+            self.assertIsNone(ti_server.check_cgcef(image), name)
+
+    def test_invalid(self):
+        for name, image in self.invalid.items():
+            self.assertIsNotNone(ti_server.check_cgcef(image), name)
+
+    def test_verify_file(self):
+        """ verify_cgcef maps the file, including an empty one """
+        directory = tempfile.mkdtemp()
+        try:
+            for name, image in self.valid.items() + self.invalid.items():
+                path = os.path.join(directory, name)
+                with open(path, 'wb') as outfile:
+                    outfile.write(image)
+                self.assertEqual(ti_server.check_cgcef(image), ti_server.verify_cgcef(path))
+            self.assertIsNotNone(ti_server.verify_cgcef(os.path.join(directory, 'missing')))
+        finally:
+            shutil.rmtree(directory)
+
+    @unittest.skipIf(distutils.spawn.find_executable('cgcef_verify') is None,
+                     'cgcef_verify is not installed')
+    def test_matches_cgcef_verify(self):
+        """ the native checks agree with cgcef_verify, on these and any installed CBs """
+        directory = tempfile.mkdtemp()
+        try:
+            paths = []
+            for name, image in self.valid.items() + self.invalid.items():
+                path = os.path.join(directory, name)
+                with open(path, 'wb') as outfile:
+                    outfile.write(image)
+                paths.append(path)
+            for pattern in ['/usr/share/cgc-challenges/*/bin/*',
+                            '/usr/share/cgc-sample-challenges/examples/*/bin/*']:
+                paths += glob.glob(pattern)
+
+            with open(os.devnull, 'w') as devnull:
+                for path in paths:
+                    external = subprocess.call(['cgcef_verify', path], stdout=devnull,
+                                               stderr=devnull) == 0
+                    native = ti_server.verify_cgcef(path)
+                    self.assertEqual(external, native is None, '%s: %s' % (path, native))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()